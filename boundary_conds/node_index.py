@@ -0,0 +1,250 @@
+"""Find the nodes of a grid by their coordinates.
+
+Selecting nodes with a mask such as::
+
+    x_condition = np.logical_and(mg.x_of_node < max_x, mg.x_of_node > min_x)
+    y_condition = np.logical_and(mg.y_of_node < max_y, mg.y_of_node > min_y)
+    my_nodes = np.logical_and(x_condition, y_condition)
+
+looks at every node of the grid, for every region. That is fine for one
+rectangle on a small grid, but with hundreds of regions (gauges, closed
+areas, fault blocks) on a large raster or Voronoi grid, it becomes the
+slow part of setting up a model. A ``NodeIndex`` sorts the nodes of a grid
+into square buckets, for boxes and polygons, and holds their coordinates in
+a KD-tree, for distances; each is built the first time it is needed, and
+each query only looks at the nodes near its region. All queries return node
+IDs, which can be used directly to set ``status_at_node``.
+
+``get_node_index`` returns the index of a grid, creating it on first use;
+later calls, for the same grid, return the same index.
+"""
+import weakref
+
+import numpy as np
+from matplotlib.path import Path
+from scipy.spatial import cKDTree
+
+
+_INDEX_OF_GRID = weakref.WeakKeyDictionary()
+
+
+def get_node_index(grid):
+    """Get the (cached) ``NodeIndex`` of a grid.
+
+    Parameters
+    ----------
+    grid : ModelGrid
+        A Landlab grid.
+
+    Returns
+    -------
+    NodeIndex
+        The index of the grid's nodes.
+
+    Examples
+    --------
+    >>> from landlab import RasterModelGrid
+    >>> mg = RasterModelGrid((4, 5), 1.)
+    >>> get_node_index(mg) is get_node_index(mg)
+    True
+    """
+    try:
+        return _INDEX_OF_GRID[grid]
+    except KeyError:
+        return _INDEX_OF_GRID.setdefault(grid, NodeIndex(grid))
+
+
+class NodeIndex(object):
+    """A spatial index of the nodes of a grid.
+
+    Node coordinates of a grid do not change, so the index stays valid for
+    the life of the grid.
+
+    Parameters
+    ----------
+    grid : ModelGrid
+        A Landlab grid.
+
+    Examples
+    --------
+    >>> from landlab import RasterModelGrid
+    >>> mg = RasterModelGrid((4, 5), 1.)
+    >>> index = NodeIndex(mg)
+    >>> index.nodes_in_box(0.5, 2.5, 0.5, 1.5)
+    array([6, 7])
+    >>> index.nodes_within(2., 2., 1.)
+    array([ 7, 11, 12, 13, 17])
+    >>> index.nodes_in_polygon([(0.5, 0.5), (3.7, 0.5), (0.5, 3.7)])
+    array([ 6,  7,  8, 11, 12, 16])
+    >>> index.nearest_node(2.2, 0.9)
+    7
+    >>> index.nearest_node([0.1, 3.8], [0.1, 2.6])
+    array([ 0, 19])
+
+    Long, thin boxes, such as a strip along a boundary, work as well.
+
+    >>> import numpy as np
+    >>> mg = RasterModelGrid((100, 1000), 1.)
+    >>> strip = NodeIndex(mg).nodes_in_box(0.5, 998.5, 10., 12.)
+    >>> len(strip)
+    998
+    >>> bool(np.all(mg.y_of_node[strip] == 11.))
+    True
+    """
+
+    def __init__(self, grid):
+        self._grid = grid
+        self._tree = None
+        self._buckets = None
+
+    @property
+    def grid(self):
+        """The grid whose nodes are indexed."""
+        return self._grid
+
+    @property
+    def tree(self):
+        """KD-tree of the node coordinates, built on first use."""
+        if self._tree is None:
+            self._tree = cKDTree(np.column_stack((self._grid.x_of_node,
+                                                  self._grid.y_of_node)))
+        return self._tree
+
+    def _build_buckets(self):
+        """Sort the nodes into square buckets, by rows of buckets."""
+        x, y = self._grid.x_of_node, self._grid.y_of_node
+        x0, y0 = x.min(), y.min()
+
+        # about four nodes per bucket
+        extent = max(np.ptp(x), np.ptp(y))
+        size = 2. * extent / np.sqrt(self._grid.number_of_nodes)
+        if size <= 0.:
+            size = 1.
+
+        col = ((x - x0) // size).astype(int)
+        row = ((y - y0) // size).astype(int)
+        n_rows, n_cols = row.max() + 1, col.max() + 1
+        bucket = row * n_cols + col
+
+        order = np.argsort(bucket, kind='mergesort')
+        offset = np.zeros(n_rows * n_cols + 1, dtype=int)
+        np.cumsum(np.bincount(bucket, minlength=n_rows * n_cols),
+                  out=offset[1:])
+
+        self._buckets = (x0, y0, size, n_rows, n_cols, order, offset)
+
+    def nodes_in_box(self, min_x, max_x, min_y, max_y, inclusive=False):
+        """Nodes inside a rectangle.
+
+        Parameters
+        ----------
+        min_x, max_x, min_y, max_y : float
+            Limits of the rectangle.
+        inclusive : bool, optional
+            If True, include nodes that lie on the edges of the rectangle.
+
+        Returns
+        -------
+        ndarray of int
+            IDs of the nodes inside the rectangle, in increasing order.
+        """
+        if min_x > max_x or min_y > max_y:
+            return np.array([], dtype=int)
+        if self._buckets is None:
+            self._build_buckets()
+        x0, y0, size, n_rows, n_cols, order, offset = self._buckets
+
+        # the buckets of a row are contiguous in the sorted nodes, so the
+        # nodes of each row of buckets that the rectangle covers are a slice
+        col = np.clip(np.floor((np.array([min_x, max_x]) - x0) / size),
+                      0, n_cols - 1).astype(int)
+        row = np.clip(np.floor((np.array([min_y, max_y]) - y0) / size),
+                      0, n_rows - 1).astype(int)
+
+        rows = np.arange(row[0], row[1] + 1)
+        start = offset[rows * n_cols + col[0]]
+        count = offset[rows * n_cols + col[1] + 1] - start
+        if count.sum() > len(order) // 2:
+            # most of the grid: checking every node is faster
+            return np.flatnonzero(self._in_box(
+                self._grid.x_of_node, self._grid.y_of_node,
+                (min_x, max_x, min_y, max_y), inclusive))
+
+        first = np.cumsum(count) - count
+        nodes = np.sort(order[np.arange(count.sum())
+                              + np.repeat(start - first, count)])
+        return nodes[self._in_box(
+            self._grid.x_of_node[nodes], self._grid.y_of_node[nodes],
+            (min_x, max_x, min_y, max_y), inclusive)]
+
+    @staticmethod
+    def _in_box(x, y, box, inclusive):
+        min_x, max_x, min_y, max_y = box
+        if inclusive:
+            return (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+        else:
+            return (x > min_x) & (x < max_x) & (y > min_y) & (y < max_y)
+
+    def nodes_within(self, x, y, radius):
+        """Nodes within a distance of a point.
+
+        Parameters
+        ----------
+        x, y : float
+            Coordinates of the point.
+        radius : float
+            Distance from the point, nodes at exactly this distance
+            included.
+
+        Returns
+        -------
+        ndarray of int
+            IDs of the nodes, in increasing order.
+        """
+        return self._sorted(self.tree.query_ball_point((x, y), radius))
+
+    def nodes_in_polygon(self, vertices):
+        """Nodes inside a polygon.
+
+        Parameters
+        ----------
+        vertices : array_like of shape (n_vertices, 2)
+            (x, y) coordinates of the vertices of the polygon, in order.
+
+        Returns
+        -------
+        ndarray of int
+            IDs of the nodes inside the polygon, in increasing order. Nodes
+            that lie on the edges of the polygon may or may not be included.
+        """
+        vertices = np.asarray(vertices, dtype=float)
+        min_x, min_y = vertices.min(axis=0)
+        max_x, max_y = vertices.max(axis=0)
+        nodes = self.nodes_in_box(min_x, max_x, min_y, max_y, inclusive=True)
+
+        points = np.column_stack((self._grid.x_of_node[nodes],
+                                  self._grid.y_of_node[nodes]))
+        return nodes[Path(vertices).contains_points(points)]
+
+    def nearest_node(self, x, y):
+        """Node nearest to a point, or to each of a set of points.
+
+        Parameters
+        ----------
+        x, y : float or array_like
+            Coordinates of the point(s).
+
+        Returns
+        -------
+        int or ndarray of int
+            ID of the nearest node to each point.
+        """
+        _, nodes = self.tree.query(np.stack((x, y), axis=-1))
+        if np.ndim(nodes) == 0:
+            return int(nodes)
+        else:
+            return np.asarray(nodes, dtype=int)
+
+    @staticmethod
+    def _sorted(nodes):
+        return np.sort(np.asarray(nodes, dtype=int))
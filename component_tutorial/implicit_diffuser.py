@@ -0,0 +1,162 @@
+"""Implicit (backward Euler) linear diffusion of topography.
+
+``LinearDiffuser`` is explicit: it subdivides each time step into internal
+steps short enough to be stable, and the number of internal steps grows with
+the diffusivity and with the square of the grid resolution.
+``ImplicitLinearDiffuser`` takes the same inputs but advances each time step
+with a single sparse linear solve, which is unconditionally stable. The
+sparse LU factorization of the system is kept and reused until the time
+step, the diffusivity or the boundary conditions change, so a long run with
+a fixed time step costs one factorization and one back-substitution per
+step.
+
+Boundary nodes keep their elevations during a step: links to FIXED_VALUE
+boundary nodes carry flux, and CLOSED boundary nodes, which have no active
+links, carry none.
+"""
+import numpy as np
+from scipy.sparse import coo_matrix, identity
+from scipy.sparse.linalg import splu
+
+
+class ImplicitLinearDiffuser(object):
+    """Diffuse topography with an implicit, sparse-solve scheme.
+
+    Construction:
+
+        ImplicitLinearDiffuser(grid, linear_diffusivity=None)
+
+    Parameters
+    ----------
+    grid : ModelGrid
+        A Landlab grid with a ``topographic__elevation`` field at nodes.
+    linear_diffusivity : float, array or field name
+        Diffusivity, in length^2 per time. An array (or the name of a field)
+        is taken to be at nodes if it is number-of-nodes long and at links
+        otherwise, as for ``LinearDiffuser``. Like ``LinearDiffuser``, each
+        link takes the larger of the diffusivities at its two nodes. An
+        array is read at each time step, so its values can be changed in
+        place during a run.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from landlab import RasterModelGrid, CLOSED_BOUNDARY
+    >>> mg = RasterModelGrid((5, 4), 10.)
+    >>> z = mg.add_zeros('node', 'topographic__elevation')
+    >>> for edge in (mg.nodes_at_left_edge, mg.nodes_at_right_edge):
+    ...     mg.status_at_node[edge] = CLOSED_BOUNDARY
+    >>> z[mg.core_nodes] = 1.
+    >>> diffuser = ImplicitLinearDiffuser(mg, linear_diffusivity=1.)
+    >>> diffuser.run_one_step(1000.)
+    >>> diffuser.number_of_factorizations
+    1
+    >>> diffuser.run_one_step(1000.)
+    >>> diffuser.number_of_factorizations
+    1
+    >>> bool(np.all(z[mg.core_nodes] < 1.))
+    True
+    """
+
+    def __init__(self, grid, linear_diffusivity=None):
+        if linear_diffusivity is None:
+            raise ValueError('linear_diffusivity must be provided')
+
+        self._grid = grid
+        self._elev = grid.at_node['topographic__elevation']
+
+        if isinstance(linear_diffusivity, str):
+            try:
+                self._kd = grid.at_node[linear_diffusivity]
+            except KeyError:
+                self._kd = grid.at_link[linear_diffusivity]
+        else:
+            self._kd = linear_diffusivity
+
+        self._lu = None
+        self._factored_with = None
+        self._number_of_factorizations = 0
+
+    @property
+    def grid(self):
+        """The grid the component works on."""
+        return self._grid
+
+    @property
+    def number_of_factorizations(self):
+        """Number of times the linear system has been factored."""
+        return self._number_of_factorizations
+
+    def _diffusivity_at_link(self):
+        kd = np.asarray(self._kd, dtype=float)
+        if kd.ndim == 0:
+            return np.full(self._grid.number_of_links, float(kd))
+        elif kd.size == self._grid.number_of_nodes:
+            return self._grid.map_max_of_link_nodes_to_link(kd)
+        else:
+            return kd
+
+    def _factor(self, dt):
+        """Build and factor the system for the core nodes."""
+        grid = self._grid
+        core_nodes = grid.core_nodes
+        links = grid.active_links
+
+        row_of_node = np.full(grid.number_of_nodes, -1, dtype=int)
+        row_of_node[core_nodes] = np.arange(len(core_nodes))
+
+        tail = grid.node_at_link_tail[links]
+        head = grid.node_at_link_head[links]
+        conductance = (self._diffusivity_at_link()[links]
+                       * grid.length_of_face[grid.face_at_link[links]]
+                       / grid.length_of_link[links])
+
+        # each link couples its tail and its head: gather the (node, other
+        # node) pairs of both ends and keep those whose first node is core.
+        node = np.concatenate((tail, head))
+        other = np.concatenate((head, tail))
+        coef = np.concatenate((conductance, conductance))
+        is_core = row_of_node[node] >= 0
+        node, other, coef = node[is_core], other[is_core], coef[is_core]
+
+        coef = coef * dt / grid.area_of_cell[grid.cell_at_node[node]]
+        rows = row_of_node[node]
+        n_core = len(core_nodes)
+
+        diagonal = np.bincount(rows, weights=coef, minlength=n_core)
+        to_core = row_of_node[other] >= 0
+        off_diagonal = coo_matrix(
+            (-coef[to_core], (rows[to_core], row_of_node[other[to_core]])),
+            shape=(n_core, n_core))
+        matrix = (identity(n_core, format='csc')
+                  + coo_matrix((diagonal, (np.arange(n_core),
+                                           np.arange(n_core))),
+                               shape=(n_core, n_core))
+                  + off_diagonal)
+
+        self._lu = splu(matrix.tocsc())
+        self._boundary_coupling = coo_matrix(
+            (coef[~to_core], (rows[~to_core], other[~to_core])),
+            shape=(n_core, grid.number_of_nodes)).tocsr()
+        self._core_nodes = core_nodes
+        self._number_of_factorizations += 1
+
+    def run_one_step(self, dt):
+        """Diffuse the topography for a time `dt` with one linear solve.
+
+        Parameters
+        ----------
+        dt : float
+            Time step.
+        """
+        kd = np.array(self._kd, dtype=float, copy=True)
+        if (self._lu is None
+                or self._factored_with[0] != dt
+                or self._factored_with[1] != self._grid.bc_set_code
+                or not np.array_equal(self._factored_with[2], kd)):
+            self._factor(dt)
+            self._factored_with = (dt, self._grid.bc_set_code, kd)
+
+        z = self._elev
+        rhs = z[self._core_nodes] + self._boundary_coupling.dot(z)
+        z[self._core_nodes] = self._lu.solve(rhs)
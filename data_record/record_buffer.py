@@ -0,0 +1,276 @@
+"""Buffered recording and vectorized aggregation for a Landlab DataRecord.
+
+Every call to ``DataRecord.add_record`` merges a new xarray Dataset into the
+record, so growing a record one time step at a time becomes quadratic over
+long runs. ``RecordBuffer`` collects per-step values into preallocated numpy
+columns and hands them to the DataRecord in chunks, which cuts the number of
+merges by a factor of ``chunk_size``.
+
+``calc_aggregate_mean`` and ``calc_aggregate_sum`` are drop-in alternatives
+to ``DataRecord.calc_aggregate_value(func=np.mean, ...)`` and
+``DataRecord.calc_aggregate_value(func=np.sum, ...)`` that use
+``np.bincount`` over ``element_id`` instead of an xarray groupby.
+"""
+import numpy as np
+import xarray as xr
+
+
+class RecordBuffer(object):
+    """Collect per-step values and flush them to a DataRecord in chunks.
+
+    Parameters
+    ----------
+    data_record : DataRecord
+        The record to which buffered values are added.
+    data_vars : list of str
+        Names of the variables recorded at each step.
+    chunk_size : int, optional
+        Number of steps held in memory before they are flushed.
+    items : bool, optional
+        If True, each variable holds one value per item of the DataRecord
+        at each step and is recorded with dimensions ``['item_id', 'time']``.
+        Otherwise each variable holds a single value per step and is
+        recorded with dimension ``['time']``. If items are added to the
+        DataRecord (with ``add_item``) between steps, the steps buffered so
+        far are flushed for the old items, and the following steps expect
+        values for all of the items.
+    dtype : data-type, optional
+        Type of the preallocated columns.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from landlab import RasterModelGrid
+    >>> from landlab.data_record import DataRecord
+    >>> grid = RasterModelGrid((3, 3))
+    >>> dr = DataRecord(grid, time=[0.],
+    ...                 data_vars={'mean_elevation': (['time'], [0.])})
+    >>> buf = RecordBuffer(dr, ['mean_elevation'], chunk_size=2)
+    >>> for t in range(1, 4):
+    ...     buf.append(t, mean_elevation=0.1 * t)
+    >>> dr.number_of_timesteps
+    3
+    >>> buf.flush()
+    >>> dr.time_coordinates
+    [0.0, 1.0, 2.0, 3.0]
+
+    Record the size of clasts, with a new clast added part way through.
+
+    >>> dr = DataRecord(grid, time=[0.],
+    ...                 items={'grid_element': 'node',
+    ...                        'element_id': np.array([[4], [4]])},
+    ...                 data_vars={'size': (['item_id', 'time'],
+    ...                                     [[1.], [2.]])})
+    >>> buf = RecordBuffer(dr, ['size'], chunk_size=10, items=True)
+    >>> buf.append(1., size=[0.9, 1.9])
+    >>> dr.add_item(time=[2.],
+    ...             new_item={'grid_element': np.array([['node']]),
+    ...                       'element_id': np.array([[1]])},
+    ...             new_item_spec={'size': (['item_id', 'time'], [[3.]])})
+    >>> buf.append(3., size=[0.8, 1.8, 2.9])
+    >>> buf.flush()
+    >>> dr.dataset['size'].values
+    array([[1. , 0.9, nan, 0.8],
+           [2. , 1.9, nan, 1.8],
+           [nan, nan, 3. , 2.9]])
+    """
+
+    def __init__(self, data_record, data_vars, chunk_size=100, items=False,
+                 dtype=float):
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+
+        self._data_record = data_record
+        self._chunk_size = int(chunk_size)
+        self._items = items
+        self._dtype = dtype
+
+        if items:
+            self._dims = ['item_id', 'time']
+        else:
+            self._dims = ['time']
+
+        self._time = np.empty(self._chunk_size, dtype=float)
+        self._columns = dict.fromkeys(data_vars)
+        self._allocate()
+        self._count = 0
+
+    def _allocate(self):
+        """Allocate the columns for the current number of items."""
+        if self._items:
+            self._n_items = self._data_record.number_of_items
+            shape = (self._n_items, self._chunk_size)
+        else:
+            shape = (self._chunk_size, )
+        for name in self._columns:
+            self._columns[name] = np.empty(shape, dtype=self._dtype)
+
+    @property
+    def chunk_size(self):
+        """Number of steps held in memory before a flush."""
+        return self._chunk_size
+
+    @property
+    def number_buffered(self):
+        """Number of steps waiting to be flushed."""
+        return self._count
+
+    def append(self, time, **values):
+        """Buffer the values of one step.
+
+        Parameters
+        ----------
+        time : float
+            Model time of the step.
+        **values : float or array_like
+            Value of each recorded variable at this step. When the buffer
+            records items, each value is number-of-items long.
+        """
+        if set(values) != set(self._columns):
+            raise KeyError(
+                'append expects values for exactly these variables: '
+                + ', '.join(sorted(self._columns)))
+
+        if (self._items
+                and self._data_record.number_of_items != self._n_items):
+            self.flush()
+            self._allocate()
+
+        self._time[self._count] = time
+        for name, value in values.items():
+            self._columns[name][..., self._count] = value
+        self._count += 1
+
+        if self._count == self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Add all buffered steps to the DataRecord with one merge."""
+        if self._count == 0:
+            return
+
+        n = self._count
+        new_record = dict(
+            (name, (self._dims, column[..., :n].copy()))
+            for name, column in self._columns.items())
+
+        if self._items:
+            self._data_record.add_record(
+                time=self._time[:n].copy(),
+                item_id=self._data_record.item_coordinates[:self._n_items],
+                new_record=new_record)
+            self._data_record.ffill_grid_element_and_id()
+        else:
+            self._data_record.add_record(time=self._time[:n].copy(),
+                                         new_record=new_record)
+        self._count = 0
+
+
+def _values_at_element(data_record, data_variable, at, filter_array):
+    """Flatten a variable and return its values and element ids at *at*."""
+    dataset = data_record.dataset
+    values, grid_element, element_id = xr.broadcast(
+        dataset[data_variable], dataset['grid_element'],
+        dataset['element_id'])
+
+    values = np.asarray(values.values, dtype=float).ravel()
+    element_id = np.asarray(element_id.values, dtype=float).ravel()
+    n_elements = data_record._grid[at].size
+
+    keep = ((grid_element.values.ravel() == at)
+            & np.isfinite(element_id) & np.isfinite(values))
+    keep[keep] = (element_id[keep] >= 0) & (element_id[keep] < n_elements)
+
+    if filter_array is not None:
+        if isinstance(filter_array, xr.DataArray):
+            filter_array = filter_array.broadcast_like(
+                dataset[data_variable]).transpose(
+                    *dataset[data_variable].dims).values
+        keep &= np.broadcast_to(
+            np.asarray(filter_array, dtype=bool),
+            dataset[data_variable].shape).ravel()
+
+    return values[keep], element_id[keep].astype(int), n_elements
+
+
+def calc_aggregate_sum(data_record, data_variable, at='node',
+                       filter_array=None, fill_value=np.nan):
+    """Sum a DataRecord variable over the items on each grid element.
+
+    Parameters
+    ----------
+    data_record : DataRecord
+        Record holding items.
+    data_variable : str
+        Name of the variable to sum.
+    at : str, optional
+        Grid element at which to aggregate.
+    filter_array : array_like of bool, optional
+        Array with dimensions matching those of the variable that is
+        `True` for entries to retain.
+    fill_value : float, optional
+        Value of elements with no items.
+
+    Returns
+    -------
+    ndarray
+        Array of size number-of-grid-elements. NaN values of the variable
+        are ignored.
+    """
+    values, element_id, n_elements = _values_at_element(
+        data_record, data_variable, at, filter_array)
+
+    count = np.bincount(element_id, minlength=n_elements)
+    out = np.bincount(element_id, weights=values, minlength=n_elements)
+    out[count == 0] = fill_value
+
+    return out
+
+
+def calc_aggregate_mean(data_record, data_variable, at='node',
+                        filter_array=None, fill_value=np.nan):
+    """Average a DataRecord variable over the items on each grid element.
+
+    Parameters
+    ----------
+    data_record : DataRecord
+        Record holding items.
+    data_variable : str
+        Name of the variable to average.
+    at : str, optional
+        Grid element at which to aggregate.
+    filter_array : array_like of bool, optional
+        Array with dimensions matching those of the variable that is
+        `True` for entries to retain.
+    fill_value : float, optional
+        Value of elements with no items.
+
+    Returns
+    -------
+    ndarray
+        Array of size number-of-grid-elements. NaN values of the variable
+        are ignored.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from landlab import RasterModelGrid
+    >>> from landlab.data_record import DataRecord
+    >>> grid = RasterModelGrid((3, 3))
+    >>> dr = DataRecord(grid,
+    ...                 items={'grid_element': 'node',
+    ...                        'element_id': np.array([4, 4, 1])},
+    ...                 data_vars={'size': (['item_id'], [1., 3., 2.])})
+    >>> calc_aggregate_mean(dr, 'size', fill_value=0.)
+    array([0., 2., 0., 0., 2., 0., 0., 0., 0.])
+    """
+    values, element_id, n_elements = _values_at_element(
+        data_record, data_variable, at, filter_array)
+
+    count = np.bincount(element_id, minlength=n_elements)
+    total = np.bincount(element_id, weights=values, minlength=n_elements)
+
+    out = np.full(n_elements, fill_value, dtype=float)
+    np.divide(total, count, out=out, where=count > 0)
+
+    return out
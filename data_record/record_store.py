@@ -0,0 +1,442 @@
+"""Disk-backed storage for long-running DataRecords.
+
+A DataRecord lives entirely in memory. ``DiskBackedRecord`` wraps a
+DataRecord and, once it holds more than ``max_timesteps`` time steps, writes
+the completed time slices to netCDF files and drops them from memory. The
+spilled slices are read back lazily as dask arrays: ``get_data`` only reads
+the file that holds the requested time, and ``calc_aggregate_value`` reduces
+the record one file at a time, so neither loads the whole record.
+
+Variables that do not vary with time (for instance, the lithology of an
+item) are never spilled: they stay in the in-memory record. In the spilled
+files, the grid element of each item is stored as a small integer code
+rather than as a string.
+"""
+import glob
+import os
+
+import numpy as np
+import xarray as xr
+
+
+# Grid elements on which items can live, in the order of their codes in the
+# spilled files. Entries without an item have code -1.
+_GRID_ELEMENTS = ('node', 'link', 'patch', 'corner', 'face', 'cell')
+
+# Reductions that calc_aggregate_value can do one file at a time
+_REDUCTIONS = {np.sum: 'sum', np.nansum: 'sum',
+               np.mean: 'mean', np.nanmean: 'mean',
+               np.min: 'min', np.amin: 'min', np.nanmin: 'min',
+               np.max: 'max', np.amax: 'max', np.nanmax: 'max'}
+
+
+def _encode_elements(values):
+    """Grid element names as codes, -1 where there is no item."""
+    values = np.asarray(values, dtype=object)
+    codes = np.full(values.shape, -1, dtype=np.int8)
+    for code, name in enumerate(_GRID_ELEMENTS):
+        codes[values == name] = code
+    return codes
+
+
+def _decode_elements(codes):
+    """Grid element names from codes, NaN where there is no item."""
+    names = np.array(_GRID_ELEMENTS + (np.nan, ), dtype=object)
+    return names[codes]
+
+
+def _for_netcdf(dataset):
+    """Encode ``grid_element``, and convert other object variables to strings.
+
+    Object arrays hold NaN for the locations of items that do not exist yet,
+    which neither netCDF nor dask can store alongside strings. These entries
+    become empty strings.
+    """
+    dataset = dataset.copy()
+    for name, var in dataset.data_vars.items():
+        if name == 'grid_element':
+            dataset[name] = var.copy(data=_encode_elements(var.values))
+        elif var.dtype == object:
+            values = var.values
+            # NaN is the only value that is not equal to itself
+            dataset[name] = var.copy(
+                data=np.where(values != values, '', values).astype(str))
+    return dataset
+
+
+def _fill_value(dtype):
+    """Value of the entries of items missing from a spilled file."""
+    if dtype.kind == 'U':
+        return ''
+    elif dtype.kind == 'i':
+        return -1
+    else:
+        return np.nan
+
+
+def _reindex_items(data, item_id):
+    """Add the missing items of *item_id* to spilled data."""
+    if isinstance(data, xr.Dataset):
+        fill_value = dict((name, _fill_value(var.dtype))
+                          for name, var in data.data_vars.items())
+    else:
+        fill_value = _fill_value(data.dtype)
+    return data.reindex(item_id=item_id, fill_value=fill_value)
+
+
+class DiskBackedRecord(object):
+    """A DataRecord that spills completed time slices to disk.
+
+    Parameters
+    ----------
+    data_record : DataRecord
+        The record to wrap. It must record time.
+    path : str
+        Directory of the netCDF files that hold the spilled time slices.
+        Files from a previous run in this directory are removed.
+    max_timesteps : int, optional
+        Number of time steps held in memory before they are spilled.
+    keep : int, optional
+        Number of the most recent time steps that stay in memory after a
+        spill, so that, for instance, ``ffill_grid_element_and_id`` can still
+        propagate item locations forward in time.
+    chunks : dict, optional
+        Dask chunk sizes used to read the spilled time slices. By default
+        each spilled file is one chunk.
+
+    Notes
+    -----
+    DataRecord has no public way to drop time steps, so ``spill`` replaces
+    the private ``_dataset`` attribute of the wrapped record with its last
+    ``keep`` time steps. This depends on DataRecord keeping all of its data
+    in that attribute, as it does in Landlab 1 and 2.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> import numpy as np
+    >>> from landlab import RasterModelGrid
+    >>> from landlab.data_record import DataRecord
+    >>> grid = RasterModelGrid((3, 3))
+    >>> dr = DataRecord(grid, time=[0.],
+    ...                 data_vars={'mean_elevation': (['time'], [0.])})
+    >>> record = DiskBackedRecord(dr, tempfile.mkdtemp(), max_timesteps=4)
+    >>> for t in range(1, 10):
+    ...     record.add_record(time=[t],
+    ...                       new_record={'mean_elevation': (['time'], [t])})
+    >>> dr.number_of_timesteps <= 4
+    True
+    >>> record.number_of_timesteps
+    10
+    >>> record.get_data(time=[2.], data_variable='mean_elevation')
+    array(2.)
+    >>> record.close()
+
+    Aggregate the sizes of items over all time steps, spilled or not.
+
+    >>> dr = DataRecord(grid, time=[0.],
+    ...                 items={'grid_element': 'node',
+    ...                        'element_id': np.array([[4], [4], [1]])},
+    ...                 data_vars={'size': (['item_id', 'time'],
+    ...                                     [[1.], [3.], [2.]])})
+    >>> record = DiskBackedRecord(dr, tempfile.mkdtemp(), max_timesteps=2)
+    >>> for t in range(1, 4):
+    ...     record.add_record(time=[t], item_id=[0, 1, 2],
+    ...                       new_record={'size': (['item_id', 'time'],
+    ...                                            [[1.], [3.], [2.]])})
+    ...     record.ffill_grid_element_and_id()
+    >>> record.number_of_spilled_files
+    2
+    >>> record.calc_aggregate_value(np.mean, 'size')
+    array([nan,  2., nan, nan,  2., nan, nan, nan, nan])
+    >>> record.calc_aggregate_value(np.max, 'size', fill_value=0.)
+    array([0., 2., 0., 0., 3., 0., 0., 0., 0.])
+    >>> record.get_data(time=[1.], item_id=[2], data_variable='grid_element')
+    array(['node'], dtype=object)
+    >>> record.close()
+    """
+
+    def __init__(self, data_record, path, max_timesteps=100, keep=1,
+                 chunks=None):
+        if 'time' not in data_record.dataset.dims:
+            raise ValueError('DiskBackedRecord needs a DataRecord that '
+                             'records time')
+        if keep < 1 or max_timesteps <= keep:
+            raise ValueError('keep must be at least 1 and less than '
+                             'max_timesteps')
+
+        self._record = data_record
+        self._grid = data_record._grid
+        self._path = path
+        self._max_timesteps = int(max_timesteps)
+        self._keep = int(keep)
+        self._chunks = chunks
+        self._parts = []
+        self._times_of_part = []
+        self._spilled = {}
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for filename in glob.glob(os.path.join(path, 'record_*.nc')):
+            os.remove(filename)
+
+    @property
+    def record(self):
+        """The in-memory DataRecord that holds the most recent time steps."""
+        return self._record
+
+    @property
+    def number_of_spilled_files(self):
+        """Number of netCDF files written so far."""
+        return len(self._parts)
+
+    def _time_variables(self, dataset):
+        return [name for name, var in dataset.data_vars.items()
+                if 'time' in var.dims]
+
+    def spill(self):
+        """Write all but the last ``keep`` time steps to disk."""
+        memory = self._record.dataset
+        n_spill = memory.sizes['time'] - self._keep
+        if n_spill <= 0:
+            return
+
+        part = _for_netcdf(
+            memory[self._time_variables(memory)].isel(time=slice(0, n_spill)))
+        filename = os.path.join(self._path,
+                                'record_%05d.nc' % len(self._parts))
+        part.to_netcdf(filename)
+        self._parts.append(filename)
+        self._times_of_part.append(part['time'].values)
+
+        self._record._dataset = memory.isel(time=slice(n_spill, None))
+
+    def _open_part(self, index):
+        """A spilled file, opened lazily."""
+        if index not in self._spilled:
+            self._spilled[index] = xr.open_dataset(
+                self._parts[index], chunks=self._chunks or {})
+        return self._spilled[index]
+
+    def close(self):
+        """Close the spilled files."""
+        for part in self._spilled.values():
+            part.close()
+        self._spilled = {}
+
+    def add_record(self, **kwds):
+        """Add a record to the in-memory DataRecord, spilling if needed.
+
+        Takes the same keywords as ``DataRecord.add_record``.
+        """
+        # spill before adding, so that the time steps kept in memory have
+        # already been filled in by the caller.
+        if self._record.number_of_timesteps >= self._max_timesteps:
+            self.spill()
+        self._record.add_record(**kwds)
+
+    def add_item(self, **kwds):
+        """Add items to the in-memory DataRecord.
+
+        Takes the same keywords as ``DataRecord.add_item``.
+        """
+        self._record.add_item(**kwds)
+
+    def ffill_grid_element_and_id(self):
+        """Forward-fill item locations of the in-memory DataRecord."""
+        self._record.ffill_grid_element_and_id()
+
+    @property
+    def dataset(self):
+        """The whole record as an xarray Dataset backed by dask arrays."""
+        memory = self._record.dataset
+        if not self._parts:
+            return memory
+
+        parts = []
+        for index in range(len(self._parts)):
+            part = self._open_part(index)
+            if 'item_id' in memory.dims:
+                # items added after a spill are missing from earlier files.
+                part = _reindex_items(part, memory.item_id)
+            if 'grid_element' in part:
+                part = part.assign(grid_element=xr.apply_ufunc(
+                    _decode_elements, part['grid_element'],
+                    dask='parallelized', output_dtypes=[object]))
+            parts.append(part)
+
+        # the in-memory part is one chunk: dask cannot choose chunk sizes
+        # for object arrays such as grid_element.
+        time_variables = self._time_variables(memory)
+        in_memory = memory[time_variables].chunk(
+            dict((dim, -1) for dim in memory[time_variables].dims))
+        combined = xr.concat(parts + [in_memory], dim='time', join='outer')
+
+        dataset = xr.merge([combined, memory.drop_vars(time_variables)],
+                           join='outer')
+        dataset.attrs.update(memory.attrs)
+        return dataset
+
+    def _part_with_time(self, time):
+        """Index of the spilled file that holds *time*, or None."""
+        for index, times in enumerate(self._times_of_part):
+            if np.any(times == time):
+                return index
+        return None
+
+    def get_data(self, time=None, item_id=None, data_variable=None):
+        """Get a variable value at a model time and/or an item.
+
+        Takes the same arguments as ``DataRecord.get_data``. With a *time*,
+        only the file that holds it is read, and only the requested values.
+        """
+        memory = self._record.dataset
+        if not self._parts or data_variable not in self._time_variables(
+                memory):
+            return self._record.get_data(time=time, item_id=item_id,
+                                         data_variable=data_variable)
+
+        if time is None:
+            data = self.dataset[data_variable]
+        else:
+            index = self._part_with_time(time[0])
+            if index is None:
+                return self._record.get_data(time=time, item_id=item_id,
+                                             data_variable=data_variable)
+            data = self._open_part(index)[data_variable].sel(time=time[0])
+            if 'item_id' in memory.dims:
+                data = _reindex_items(data, memory.item_id)
+
+        if item_id is not None:
+            data = data.isel(item_id=item_id)
+
+        values = data.values
+        if time is not None and data_variable == 'grid_element':
+            values = _decode_elements(values)
+        return values
+
+    def _as_filter(self, filter_array):
+        """A filter as a DataArray with item_id and/or time dimensions."""
+        if filter_array is None or isinstance(filter_array, xr.DataArray):
+            return filter_array
+
+        filter_array = np.asarray(filter_array, dtype=bool)
+        coords = {'item_id': self.item_coordinates,
+                  'time': self.time_coordinates}
+        if filter_array.ndim == 2:
+            dims = ('item_id', 'time')
+        elif len(filter_array) == self.number_of_items:
+            dims = ('item_id', )
+        else:
+            dims = ('time', )
+        return xr.DataArray(filter_array, dims=dims,
+                            coords=dict((dim, coords[dim]) for dim in dims))
+
+    def _parts_for_aggregation(self, data_variable):
+        """Item locations and a variable, one file at a time."""
+        memory = self._record.dataset
+        names = ['grid_element', 'element_id']
+        is_spilled = data_variable in self._time_variables(memory)
+
+        for index in range(len(self._parts)):
+            # compute, rather than load, leaves the opened file lazy
+            if is_spilled:
+                part = self._open_part(index)[names + [data_variable]]
+                part = part.compute()
+            else:
+                part = self._open_part(index)[names].compute()
+                part[data_variable] = memory[data_variable]
+            yield part
+
+        part = memory[names + [data_variable]]
+        yield part.assign(grid_element=part['grid_element'].copy(
+            data=_encode_elements(part['grid_element'].values)))
+
+    def calc_aggregate_value(self, func, data_variable, at='node',
+                             filter_array=None, fill_value=np.nan):
+        """Apply a function to a variable aggregated at grid elements.
+
+        Takes the same arguments as ``DataRecord.calc_aggregate_value``, and
+        aggregates over both the spilled and the in-memory time steps. The
+        record is reduced one file at a time, so *func* must be one of the
+        reductions that can be combined across files: ``np.sum``,
+        ``np.mean``, ``np.min`` or ``np.max`` (or their ``nan`` versions).
+        NaN values are ignored.
+        """
+        try:
+            reduction = _REDUCTIONS[func]
+        except (KeyError, TypeError):
+            raise ValueError(
+                'func must be one of np.sum, np.mean, np.min or np.max')
+
+        n_elements = self._grid[at].size
+        at_code = _GRID_ELEMENTS.index(at)
+        filter_array = self._as_filter(filter_array)
+
+        count = np.zeros(n_elements, dtype=int)
+        if reduction == 'min':
+            out = np.full(n_elements, np.inf)
+        elif reduction == 'max':
+            out = np.full(n_elements, -np.inf)
+        else:
+            out = np.zeros(n_elements)
+
+        for part in self._parts_for_aggregation(data_variable):
+            element, element_id, values = xr.broadcast(
+                part['grid_element'], part['element_id'],
+                part[data_variable])
+            dims = element.dims
+            element_id = element_id.transpose(*dims).values.ravel()
+            values = values.transpose(*dims).values.ravel()
+
+            keep = ((element.values.ravel() == at_code)
+                    & np.isfinite(element_id) & np.isfinite(values))
+            if filter_array is not None:
+                part_filter = filter_array
+                if 'time' in part_filter.dims:
+                    part_filter = part_filter.sel(time=part['time'])
+                if 'item_id' in part_filter.dims:
+                    part_filter = part_filter.reindex(
+                        item_id=part['item_id'], fill_value=False)
+                keep &= xr.broadcast(part_filter, element)[0].transpose(
+                    *dims).values.ravel().astype(bool)
+            keep[keep] = ((element_id[keep] >= 0)
+                          & (element_id[keep] < n_elements))
+
+            ids = element_id[keep].astype(int)
+            count += np.bincount(ids, minlength=n_elements)
+            if reduction == 'min':
+                np.minimum.at(out, ids, values[keep])
+            elif reduction == 'max':
+                np.maximum.at(out, ids, values[keep])
+            else:
+                out += np.bincount(ids, weights=values[keep],
+                                   minlength=n_elements)
+
+        if reduction == 'mean':
+            out[count > 0] /= count[count > 0]
+        out[count == 0] = fill_value
+        return out
+
+    @property
+    def number_of_items(self):
+        """Return the number of items in the DataRecord."""
+        return self._record.number_of_items
+
+    @property
+    def item_coordinates(self):
+        """Return a list of the item_id coordinates in the DataRecord."""
+        return self._record.item_coordinates
+
+    @property
+    def number_of_timesteps(self):
+        """Return the number of time steps, spilled or not."""
+        return (sum(len(times) for times in self._times_of_part)
+                + self._record.number_of_timesteps)
+
+    @property
+    def time_coordinates(self):
+        """Return a list of all time coordinates, spilled or not."""
+        return np.concatenate(
+            self._times_of_part
+            + [self._record.dataset['time'].values]).tolist()
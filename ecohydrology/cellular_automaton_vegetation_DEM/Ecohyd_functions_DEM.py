@@ -4,6 +4,7 @@ from __future__ import print_function
 import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+from landlab import RasterModelGrid
 from landlab.plot import imshow_grid
 from landlab.components import PrecipitationDistribution
 from landlab.components import Radiation
@@ -140,6 +141,74 @@ def Create_PET_lookup(Rad, PET_Tree, PET_Shrub, PET_Grass, PET_,
             EP30[i] = np.mean(PET_[i-30:i], axis=0)
 
 
+# Fields that carry over from one storm to the next, and from one year to
+# the next, in the soil moisture and vegetation components
+STATE_FIELDS = ['soil_moisture__initial_saturation_fraction',
+                'vegetation__live_leaf_area_index',
+                'vegetation__cover_fraction']
+
+
+# Function to bin cells by radiation factor
+def Radiation_classes(Rad_Factor, tolerance=0.02):
+    # Cells whose annual mean radiation factor falls in the same bin of width
+    # 'tolerance' form a class. The radiation factor of a class on each day
+    # of the year is the mean over its cells. A smaller tolerance gives more
+    # classes and a closer match to running every cell.
+    mean_factor = Rad_Factor.mean(axis=0)
+    bins = np.floor(mean_factor / tolerance).astype(int)
+    (unique_bins, rad_class) = np.unique(bins, return_inverse=True)
+    n_rad = unique_bins.size
+    cells_in_class = np.bincount(rad_class, minlength=n_rad)
+    Rad_Factor_class = np.empty([Rad_Factor.shape[0], n_rad])
+    for i in range(0, Rad_Factor.shape[0]):
+        Rad_Factor_class[i] = (np.bincount(rad_class, weights=Rad_Factor[i],
+                                           minlength=n_rad) / cells_in_class)
+    return rad_class, Rad_Factor_class
+
+
+# Function to map every cell to its (PFT, radiation factor) class
+def Class_at_cell(grid, rad_class, n_rad):
+    return grid['cell']['vegetation__plant_functional_type'] * n_rad + rad_class
+
+
+def Initialize_classes(data, n_rad):
+    # Representative grid with one cell per (PFT, radiation factor) class;
+    # class k holds PFT k // n_rad in radiation class k % n_rad.
+    n_classes = 6 * n_rad
+    grid_c = RasterModelGrid((3, n_classes + 2), spacing=(5., 5.))
+    grid_c['cell']['vegetation__plant_functional_type'] = np.repeat(
+                                            np.arange(0, 6), n_rad)
+    grid_c['node']['topographic__elevation'] = (
+                                    1700. * np.ones(grid_c.number_of_nodes))
+    SM_c = SoilMoisture(grid_c, **data)   # Soil Moisture object for classes
+    VEG_c = Vegetation(grid_c, **data)    # Vegetation object for classes
+    grid_c['cell']['vegetation__live_leaf_area_index'] = (
+                                    1.6 * np.ones(grid_c.number_of_cells))
+    grid_c['cell']['soil_moisture__initial_saturation_fraction'] = (
+                                    0.59 * np.ones(grid_c.number_of_cells))
+    rad_c = np.tile(np.arange(0, n_rad), 6)
+    return grid_c, SM_c, VEG_c, rad_c
+
+
+def Scatter_to_cells(grid, grid_c, class_at_cell, names=STATE_FIELDS):
+    # Copy the values of each class to all of its cells
+    for name in names:
+        grid['cell'][name][:] = grid_c['cell'][name][class_at_cell]
+
+
+def Gather_to_classes(grid, grid_c, class_at_cell, names=STATE_FIELDS):
+    # Set the values of each occupied class to the mean over its cells.
+    # Unoccupied classes keep their values.
+    n_classes = grid_c.number_of_cells
+    cells_in_class = np.bincount(class_at_cell, minlength=n_classes)
+    occupied = cells_in_class > 0
+    for name in names:
+        total = np.bincount(class_at_cell, weights=grid['cell'][name],
+                            minlength=n_classes)
+        grid_c['cell'][name][occupied] = (total[occupied] /
+                                          cells_in_class[occupied])
+
+
 def Save_(sim, Tb, Tr, P, VegType, yrs, Time_Consumed, Time):
     np.save(sim+'Tb', Tb)
     np.save(sim+'Tr', Tr)
@@ -15,7 +15,10 @@ import numpy as np
 from landlab.io import read_esri_ascii
 from landlab import RasterModelGrid as rmg
 from Ecohyd_functions_DEM import (txt_data_dict, Initialize_, Empty_arrays,
-                                  Create_PET_lookup, Save_, Plot_)
+                                  Create_PET_lookup, Save_, Plot_,
+                                  Radiation_classes, Initialize_classes,
+                                  Class_at_cell, Scatter_to_cells,
+                                  Gather_to_classes)
 
 (grid, elevation) = read_esri_ascii('DEM_10m.asc')    # Read the DEM
 grid1 = rmg((5, 4), spacing=(5., 5.))                 # Representative grid
@@ -27,6 +30,10 @@ PD_D, PD_W, Rad, Rad_PET, PET_Tree, PET_Shrub, PET_Grass, SM, VEG, vegca = (
                 Initialize_(data, grid, grid1, elevation))
 
 n_years = 50       # Approx number of years for model to run
+# Width of the radiation factor bins for running the soil moisture and
+# vegetation components on (PFT, radiation class) representatives instead of
+# on every cell (e.g. 0.02). None runs every cell.
+rad_tolerance = None
 # Calculate approximate number of storms per year
 fraction_wet = (data['doy__end_of_monsoon']-data['doy__start_of_monsoon'])/365.
 fraction_dry = 1 - fraction_wet
@@ -42,6 +49,16 @@ P, Tb, Tr, Time, VegType, PET_, Rad_Factor, EP30, PET_threshold = (
 Create_PET_lookup(Rad, PET_Tree, PET_Shrub, PET_Grass,  PET_, Rad_Factor,
                   EP30, Rad_PET, grid)
 
+if rad_tolerance is not None:
+    rad_class, Rad_Factor_c = Radiation_classes(Rad_Factor,
+                                                tolerance=rad_tolerance)
+    n_rad = Rad_Factor_c.shape[1]
+    grid_c, SM_c, VEG_c, rad_c = Initialize_classes(data, n_rad)
+    class_at_cell = Class_at_cell(grid, rad_class, n_rad)
+    Gather_to_classes(grid, grid_c, class_at_cell)
+    print 'Running', grid.number_of_cells, 'cells in', \
+        grid_c.number_of_cells, 'classes'
+
 # # Represent current time in years
 current_time = 0            # Start from first day of Jan
 
@@ -76,20 +93,35 @@ for i in range(0, n):
         Tr[i] = PD_W.get_precipitation_event_duration()
         Tb[i] = PD_W.get_interstorm_event_duration()
 
-    # Spatially distribute PET and its 30-day-mean (analogous to degree day)
-    grid['cell']['surface__potential_evapotranspiration_rate'] = (
+    if rad_tolerance is None:
+        # Spatially distribute PET and its 30-day-mean (analogous to degree
+        # day)
+        grid['cell']['surface__potential_evapotranspiration_rate'] = (
                 (np.choose(grid['cell']['vegetation__plant_functional_type'],
                            PET_[Julian])) * Rad_Factor[Julian])
-    grid['cell']['surface__potential_evapotranspiration_30day_mean'] = (
+        grid['cell']['surface__potential_evapotranspiration_30day_mean'] = (
                 (np.choose(grid['cell']['vegetation__plant_functional_type'],
                            EP30[Julian])) * Rad_Factor[Julian])
 
-    # Assign spatial rainfall data
-    grid['cell']['rainfall__daily_depth'] = (P[i] *
-                                             np.ones(grid.number_of_cells))
+        # Assign spatial rainfall data
+        grid['cell']['rainfall__daily_depth'] = (
+                P[i] * np.ones(grid.number_of_cells))
 
-    # Update soil moisture component
-    current_time = SM.update(current_time, Tr=Tr[i], Tb=Tb[i])
+        # Update soil moisture component
+        current_time = SM.update(current_time, Tr=Tr[i], Tb=Tb[i])
+    else:
+        # PET, its 30-day-mean and rainfall for each class
+        grid_c['cell']['surface__potential_evapotranspiration_rate'] = (
+                (np.choose(grid_c['cell']['vegetation__plant_functional_type'],
+                           PET_[Julian])) * Rad_Factor_c[Julian][rad_c])
+        grid_c['cell']['surface__potential_evapotranspiration_30day_mean'] = (
+                (np.choose(grid_c['cell']['vegetation__plant_functional_type'],
+                           EP30[Julian])) * Rad_Factor_c[Julian][rad_c])
+        grid_c['cell']['rainfall__daily_depth'] = (
+                P[i] * np.ones(grid_c.number_of_cells))
+
+        # Update soil moisture component of the classes
+        current_time = SM_c.update(current_time, Tr=Tr[i], Tb=Tb[i])
 
     # Decide whether its growing season or not
     if Julian != 364:
@@ -100,11 +132,13 @@ for i in range(0, n):
             PET_threshold = 0
             # 0 corresponds to ETThresholddown (end growing season)
 
-    # Update vegetation component
-    VEG.update(PETthreshold_switch=PET_threshold, Tb=Tb[i], Tr=Tr[i])
-
-    # Update yearly cumulative water stress data
-    WS += (grid['cell']['vegetation__water_stress'])*Tb[i]/24.
+    # Update vegetation component, and yearly cumulative water stress data
+    if rad_tolerance is None:
+        VEG.update(PETthreshold_switch=PET_threshold, Tb=Tb[i], Tr=Tr[i])
+        WS += (grid['cell']['vegetation__water_stress'])*Tb[i]/24.
+    else:
+        VEG_c.update(PETthreshold_switch=PET_threshold, Tb=Tb[i], Tr=Tr[i])
+        WS += (grid_c['cell']['vegetation__water_stress'])*Tb[i]/24.
 
     # Record time (optional)
     Time[i] = current_time
@@ -114,10 +148,22 @@ for i in range(0, n):
         if yrs % 5 == 0:
             print 'Elapsed time = ', yrs, ' years'
         VegType[yrs] = grid['cell']['vegetation__plant_functional_type']
-        grid['cell']['vegetation__cumulative_water_stress'] = WS/Tg
-        vegca.update()
-        SM.initialize()
-        VEG.initialize()
+        if rad_tolerance is None:
+            grid['cell']['vegetation__cumulative_water_stress'] = WS/Tg
+            vegca.update()
+            SM.initialize()
+            VEG.initialize()
+        else:
+            # Cellular Automata on the DEM, then move cells to their new
+            # classes
+            grid['cell']['vegetation__cumulative_water_stress'] = (
+                (WS/Tg)[class_at_cell])
+            Scatter_to_cells(grid, grid_c, class_at_cell)
+            vegca.update()
+            class_at_cell = Class_at_cell(grid, rad_class, n_rad)
+            Gather_to_classes(grid, grid_c, class_at_cell)
+            SM_c.initialize()
+            VEG_c.initialize()
         time_check = current_time
         WS = 0
         yrs += 1
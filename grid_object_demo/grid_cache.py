@@ -0,0 +1,298 @@
+"""Save a constructed grid to disk, and map it back into memory.
+
+Creating a ``VoronoiDelaunayGrid`` (or a ``HexModelGrid``) triangulates the
+nodes and then works out the links, patches, cells and faces, their
+connectivity, lengths and areas. For a large mesh this takes a long time,
+and it is repeated every time a model starts, even though the result only
+depends on the node coordinates.
+
+``save_grid`` writes a grid, with all of its topology, to a directory: the
+arrays each go to a ``.npy`` file, and everything else to a small pickle.
+The directory is written under a temporary name and then renamed, so a
+grid is never seen half-written, and model runs (say, the members of an
+ensemble) that save the same grid at the same time do not overwrite each
+other's files.
+``load_grid`` reads it back with the arrays memory-mapped, so only the parts
+of the grid that are used are read from disk. The arrays are mapped
+copy-on-write: changes to the loaded grid (for instance, to
+``status_at_node``) are not written back to the files.
+
+The whole grid object is pickled, not just its topology: Landlab has no
+way to create a grid from topology that was worked out before (its own
+``VoronoiDelaunayGrid.save`` pickles the grid too), and setting a new
+grid's private attributes by hand would tie this module even more closely
+to how the grid classes are laid out. The cost is size. Everything the
+grid holds is saved, including the arrays padded to the largest number of
+links at a node, which comes to about 1.5 kB per node (150 MB, in a few
+dozen ``.npy`` files, for a grid of 100,000 nodes), roughly one and a half
+times the size of the arrays in ``_TOPOLOGY`` alone.
+
+A saved grid is tagged with a key, made by ``grid_key`` from the grid class
+and the arguments used to create it (the node coordinates, for a Voronoi
+grid), and the Landlab version. ``load_grid`` refuses to load a grid whose
+key does not match, so a grid pickled by one version of Landlab is created
+and saved again by another, rather than loaded into a class whose layout
+may have changed. ``cached_grid`` puts these together: it loads the grid
+if a matching one has been saved, and otherwise creates and saves it.
+"""
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+import landlab
+
+
+# Arrays that some grids only compute when first asked for. They are
+# computed before a grid is saved, so that they are saved with it.
+_TOPOLOGY = ('nodes_at_link', 'links_at_node', 'link_dirs_at_node',
+             'active_link_dirs_at_node', 'adjacent_nodes_at_node',
+             'patches_at_node', 'nodes_at_patch', 'links_at_patch',
+             'patches_at_link', 'node_at_cell', 'cell_at_node',
+             'face_at_link', 'link_at_face', 'faces_at_cell',
+             'area_of_cell', 'area_of_patch', 'length_of_face',
+             'length_of_link', 'status_at_node', 'status_at_link',
+             'active_links', 'core_nodes')
+
+# Arrays smaller than this (in bytes) stay in the pickle.
+_MIN_MAPPED_BYTES = 1024
+
+
+def grid_key(grid_class, *args, **kwds):
+    """Make a key that identifies a grid by how it was created.
+
+    Parameters
+    ----------
+    grid_class : type
+        Class of the grid, for instance ``VoronoiDelaunayGrid``.
+    *args, **kwds
+        Arguments used to create the grid. Arrays (such as node
+        coordinates) are hashed by value.
+
+    Returns
+    -------
+    str
+        A hex digest.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from landlab import VoronoiDelaunayGrid
+    >>> x, y = np.array([0., 1., 0., 1., .5]), np.array([0., 0., 1., 1., .5])
+    >>> grid_key(VoronoiDelaunayGrid, x, y) == grid_key(VoronoiDelaunayGrid,
+    ...                                                 x.copy(), y.copy())
+    True
+    >>> grid_key(VoronoiDelaunayGrid, x, y) == grid_key(VoronoiDelaunayGrid,
+    ...                                                 x, y + 1.)
+    False
+    """
+    digest = hashlib.sha1()
+    digest.update(grid_class.__name__.encode())
+    digest.update(landlab.__version__.encode())
+
+    for value in args:
+        _update_digest(digest, value)
+    for name in sorted(kwds):
+        digest.update(name.encode())
+        _update_digest(digest, kwds[name])
+
+    return digest.hexdigest()
+
+
+def _update_digest(digest, value):
+    """Add an argument to a digest, numeric arrays by value."""
+    if isinstance(value, (np.ndarray, list, tuple)):
+        array = np.asarray(value)
+        if array.dtype.kind in 'biuf':
+            array = np.ascontiguousarray(array, dtype=float)
+            digest.update(str(array.shape).encode())
+            digest.update(array.tobytes())
+            return
+    digest.update(repr(value).encode())
+
+
+class _ArrayPickler(pickle.Pickler):
+    """Pickle a grid, with its arrays saved as separate ``.npy`` files."""
+
+    def __init__(self, file, path):
+        pickle.Pickler.__init__(self, file, protocol=2)
+        self._path = path
+        self._saved = {}
+
+    def persistent_id(self, obj):
+        if (type(obj) is not np.ndarray or obj.dtype.hasobject
+                or obj.nbytes < _MIN_MAPPED_BYTES):
+            return None
+        try:
+            return self._saved[id(obj)][0]
+        except KeyError:
+            filename = 'array_%05d.npy' % len(self._saved)
+            np.save(os.path.join(self._path, filename), obj)
+            # keep obj alive, so that its id is not reused while pickling
+            self._saved[id(obj)] = (filename, obj)
+            return filename
+
+
+class _ArrayUnpickler(pickle.Unpickler):
+    """Unpickle a grid, memory-mapping its ``.npy`` files."""
+
+    def __init__(self, file, path):
+        pickle.Unpickler.__init__(self, file)
+        self._path = path
+
+    def persistent_load(self, pid):
+        return np.load(os.path.join(self._path, pid), mmap_mode='c')
+
+
+def save_grid(grid, path, key):
+    """Save a grid, with its topology, to a directory.
+
+    The whole grid is pickled, which takes about 1.5 kB per node (see the
+    module docstring for why).
+
+    Parameters
+    ----------
+    grid : ModelGrid
+        A Landlab grid. Its fields and boundary conditions are saved too.
+    path : str
+        Directory of the saved grid. A grid already saved there is
+        replaced.
+    key : str
+        Key that ``load_grid`` checks before loading, usually from
+        ``grid_key``.
+
+    Raises
+    ------
+    ValueError
+        If *path* holds files other than a saved grid.
+    """
+    for name in _TOPOLOGY:
+        try:
+            getattr(grid, name)
+        except (AttributeError, NotImplementedError):
+            pass
+
+    path = os.path.abspath(path)
+    if (os.path.isdir(path) and os.listdir(path)
+            and not os.path.isfile(os.path.join(path, 'grid.pickle'))):
+        raise ValueError(
+            '{path} is not empty and does not hold a saved grid'.format(
+                path=path))
+
+    parent, name = os.path.split(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp_path = tempfile.mkdtemp(prefix='.' + name + '.', dir=parent)
+    try:
+        with open(os.path.join(tmp_path, 'grid.pickle'), 'wb') as fp:
+            pickler = _ArrayPickler(fp, tmp_path)
+            pickler.dump(key)
+            pickler.dump(grid)
+        _replace_dir(tmp_path, path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def _replace_dir(src, dst):
+    """Move directory *src* to *dst*, replacing *dst*."""
+    try:
+        # works if dst does not exist, or is empty
+        os.rename(src, dst)
+        return
+    except OSError:
+        pass
+
+    old = src + '.old'
+    try:
+        os.rename(dst, old)
+    except OSError:
+        # another process moved it away
+        old = None
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # another process saved a grid in the meantime; keep that one
+        shutil.rmtree(src, ignore_errors=True)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def load_grid(path, key):
+    """Load a grid saved with ``save_grid``.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the saved grid.
+    key : str
+        Key the grid must have been saved with.
+
+    Returns
+    -------
+    ModelGrid
+        The grid, with its arrays memory-mapped from *path*.
+
+    Raises
+    ------
+    IOError
+        If there is no saved grid in *path*.
+    ValueError
+        If the saved grid has a different key.
+    """
+    with open(os.path.join(path, 'grid.pickle'), 'rb') as fp:
+        unpickler = _ArrayUnpickler(fp, path)
+        saved_key = unpickler.load()
+        if saved_key != key:
+            raise ValueError(
+                'grid in {path} was saved from different inputs'.format(
+                    path=path))
+        return unpickler.load()
+
+
+def cached_grid(path, grid_class, *args, **kwds):
+    """Load a grid from *path*, or create it and save it there.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the saved grid.
+    grid_class : type
+        Class of the grid, for instance ``VoronoiDelaunayGrid``.
+    *args, **kwds
+        Arguments used to create the grid.
+
+    Returns
+    -------
+    ModelGrid
+        The grid.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> import numpy as np
+    >>> from landlab import VoronoiDelaunayGrid
+    >>> path = tempfile.mkdtemp()
+    >>> x, y = np.random.rand(50), np.random.rand(50)
+    >>> vmg = cached_grid(path, VoronoiDelaunayGrid, x, y)
+    >>> vmg2 = cached_grid(path, VoronoiDelaunayGrid, x, y)
+    >>> np.array_equal(vmg.nodes_at_patch, vmg2.nodes_at_patch)
+    True
+    >>> np.array_equal(vmg.area_of_cell, vmg2.area_of_cell)
+    True
+    """
+    key = grid_key(grid_class, *args, **kwds)
+    try:
+        return load_grid(path, key)
+    except (IOError, OSError, ValueError, EOFError, ImportError,
+            pickle.UnpicklingError):
+        # some grids reorder the coordinate arrays they are given, which
+        # would change the key of the next call
+        args = [np.copy(arg) if isinstance(arg, np.ndarray) else arg
+                for arg in args]
+        grid = grid_class(*args, **kwds)
+        save_grid(grid, path, key)
+        return grid
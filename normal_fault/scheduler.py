@@ -0,0 +1,291 @@
+"""Run coupled Landlab components, each at its own cadence.
+
+Coupled models are usually driven by a loop like::
+
+    for i in range(N):
+        nf.run_one_step(dt)
+        fr.run_one_step()
+        fs.run_one_step(dt)
+
+which reroutes flow at every step, even when the flow network has not
+changed. ``ComponentScheduler`` runs the same components in the same order,
+but
+
+*  each component can run every *n* model steps, in which case it is passed
+   the time elapsed since it last ran (*n* times the model step),
+*  a flow router added with ``add_flow_router`` is only run when the
+   steepest-descent neighbor of a node, or the boundary conditions, have
+   changed since the last routing,
+*  the wall-clock time spent in each component is recorded.
+"""
+from timeit import default_timer
+
+import numpy as np
+
+from landlab import CLOSED_BOUNDARY
+
+
+def _has_depression_finder(router):
+    """Check if a flow router fills or routes through depressions."""
+    return (getattr(router, 'depression_finder', None) is not None
+            or bool(getattr(router, '_depression_finder_provided', None)))
+
+
+def _routing_method(router):
+    """Routing method (D4, D8, MFD, ...) of a flow router."""
+    director = getattr(router, 'flow_director', router)
+    method = (getattr(director, 'method', None)
+              or getattr(director, '_method', None))
+    if method is None:
+        method = {'FlowDirectorSteepest': 'D4',
+                  'FlowDirectorD8': 'D8'}.get(type(director).__name__)
+    return method
+
+
+class ComponentScheduler(object):
+    """Run a sequence of components at their own cadences.
+
+    Parameters
+    ----------
+    grid : ModelGrid
+        The grid shared by the components.
+    surface : str, optional
+        Name of the node field that flow is routed over.
+
+    Examples
+    --------
+    >>> from landlab import RasterModelGrid
+    >>> from landlab.components import FlowAccumulator, FastscapeEroder
+    >>> mg = RasterModelGrid((10, 10), 10.)
+    >>> z = mg.add_zeros('node', 'topographic__elevation')
+    >>> z += mg.x_of_node / 100. + mg.y_of_node / 1000.
+    >>> scheduler = ComponentScheduler(mg)
+    >>> scheduler.add_flow_router(FlowAccumulator(mg))
+    >>> scheduler.add(FastscapeEroder(mg, K_sp=1e-5))
+    >>> scheduler.run(100., 5)
+    >>> scheduler.timings['FlowAccumulator']['calls']
+    1
+    >>> scheduler.timings['FlowAccumulator']['skips']
+    4
+
+    Routing with a depression finder depends on more than the
+    steepest-descent network, so it is never skipped.
+
+    >>> scheduler.add_flow_router(FlowAccumulator(
+    ...     mg, flow_director='D8',
+    ...     depression_finder='DepressionFinderAndRouter'))
+    Traceback (most recent call last):
+    ...
+    ValueError: routers with a depression finder cannot be skipped
+    """
+
+    def __init__(self, grid, surface='topographic__elevation'):
+        self._grid = grid
+        self._surface = surface
+        self._entries = []
+        self._timings = {}
+        self._current_step = 0
+        self._neighbors = None
+
+    @property
+    def grid(self):
+        """The grid shared by the components."""
+        return self._grid
+
+    @property
+    def timings(self):
+        """Number of calls and skips, and run time, of each component."""
+        return self._timings
+
+    def _add(self, component, every, name, uses_dt, router):
+        if every < 1:
+            raise ValueError('every must be a positive integer')
+        if name is None:
+            name = getattr(component, '__name__', type(component).__name__)
+        base, count = name, 1
+        while name in self._timings:
+            count += 1
+            name = '{0}_{1}'.format(base, count)
+
+        self._entries.append({'component': component, 'every': int(every),
+                              'name': name, 'uses_dt': uses_dt,
+                              'router': router, 'elapsed': 0.})
+        self._timings[name] = {'calls': 0, 'skips': 0, 'seconds': 0.}
+
+    def add(self, component, every=1, name=None, uses_dt=True):
+        """Add a component that runs every *every* model steps.
+
+        Parameters
+        ----------
+        component : Component or function
+            A component with a ``run_one_step`` method, or a function that
+            is called instead of ``run_one_step`` (for instance, to add
+            uplift).
+        every : int, optional
+            Cadence of the component, in model steps.
+        name : str, optional
+            Name of the component in ``timings``. Defaults to the class name.
+        uses_dt : bool, optional
+            If True, ``run_one_step`` is passed the time elapsed since the
+            component last ran.
+        """
+        self._add(component, every, name, uses_dt, False)
+
+    def add_flow_router(self, router, every=1, name=None):
+        """Add a flow router that only runs when the flow network may change.
+
+        The router is skipped if no node has a different steepest-descent
+        neighbor than at the last routing, and the boundary conditions are
+        unchanged. The receivers and drainage areas of the last routing are
+        then still valid; the ``topographic__steepest_slope`` field, if
+        present, is updated with the new slopes to the receivers.
+
+        Neighbors are those of the router's flow director: the eight
+        neighbors of a node for D8 routing on a raster grid, the adjacent
+        nodes otherwise.
+
+        Parameters
+        ----------
+        router : Component
+            A flow router, such as ``FlowAccumulator``.
+        every : int, optional
+            Cadence at which the router is considered, in model steps.
+        name : str, optional
+            Name of the router in ``timings``. Defaults to the class name.
+
+        Raises
+        ------
+        ValueError
+            If the routing does not only depend on the steepest-descent
+            network: the router has a depression finder, or sends flow to
+            more than one receiver. Add such routers with
+            ``add(router, uses_dt=False)``.
+        """
+        if _has_depression_finder(router):
+            raise ValueError('routers with a depression finder cannot be '
+                             'skipped')
+        method = _routing_method(router)
+        if method not in ('D4', 'D8'):
+            raise ValueError('only D4 and D8 routers can be skipped')
+
+        if method == 'D8' and hasattr(self._grid,
+                                      'diagonal_adjacent_nodes_at_node'):
+            self._neighbors = np.hstack(
+                (self._grid.adjacent_nodes_at_node,
+                 self._grid.diagonal_adjacent_nodes_at_node))
+        else:
+            self._neighbors = np.array(self._grid.adjacent_nodes_at_node)
+
+        is_missing = self._neighbors == -1
+        neighbors = np.where(is_missing, 0, self._neighbors)
+        self._distance_to_neighbor = np.hypot(
+            self._grid.x_of_node[neighbors]
+            - self._grid.x_of_node.reshape((-1, 1)),
+            self._grid.y_of_node[neighbors]
+            - self._grid.y_of_node.reshape((-1, 1)))
+        self._distance_to_neighbor[is_missing] = np.inf
+        self._last_routing = None
+
+        self._add(router, every, name, False, True)
+
+    def _steepest_neighbors(self):
+        """Steepest downhill neighbor of each node, or -1."""
+        z = self._grid.at_node[self._surface]
+        neighbors = self._neighbors
+        slope = ((z.reshape((-1, 1)) - z[neighbors])
+                 / self._distance_to_neighbor)
+
+        is_closed = self._grid.status_at_node == CLOSED_BOUNDARY
+        slope[(neighbors == -1) | is_closed[neighbors]] = -np.inf
+
+        steepest = np.argmax(slope, axis=1)
+        steepest = neighbors[np.arange(len(steepest)), steepest]
+        steepest[slope.max(axis=1) <= 0.] = -1
+        steepest[is_closed] = -1
+
+        return steepest
+
+    def _flow_network_changed(self):
+        """Check, and remember, the steepest-descent network."""
+        state = (self._grid.bc_set_code, self._steepest_neighbors())
+        changed = (self._last_routing is None
+                   or state[0] != self._last_routing[0]
+                   or not np.array_equal(state[1], self._last_routing[1]))
+        self._last_routing = state
+        return changed
+
+    def _update_steepest_slope(self):
+        """Update the slopes to the receivers after a skipped routing."""
+        at_node = self._grid.at_node
+        if 'topographic__steepest_slope' not in at_node:
+            return
+
+        z = at_node[self._surface]
+        receiver = at_node['flow__receiver_node']
+        link = at_node['flow__link_to_receiver_node']
+        if receiver.ndim > 1:
+            return
+
+        length_of_link = getattr(self._grid, 'length_of_d8',
+                                 self._grid.length_of_link)
+        has_link = link != -1
+        slope = at_node['topographic__steepest_slope']
+        slope.fill(0.)
+        slope[has_link] = ((z[has_link] - z[receiver[has_link]])
+                           / length_of_link[link[has_link]])
+
+    def run_one_step(self, dt):
+        """Advance the model by one step of length *dt*.
+
+        Parameters
+        ----------
+        dt : float
+            Model time step.
+        """
+        for entry in self._entries:
+            entry['elapsed'] += dt
+            # components that integrate over time run at the end of their
+            # period, so that they are passed all of the elapsed time; the
+            # others, such as flow routers, run at its start.
+            if entry['uses_dt']:
+                step = self._current_step + 1
+            else:
+                step = self._current_step
+            if step % entry['every'] != 0:
+                continue
+
+            timing = self._timings[entry['name']]
+            start = default_timer()
+
+            if entry['router'] and not self._flow_network_changed():
+                self._update_steepest_slope()
+                timing['skips'] += 1
+            else:
+                run = getattr(entry['component'], 'run_one_step',
+                              entry['component'])
+                if entry['uses_dt']:
+                    run(entry['elapsed'])
+                else:
+                    run()
+                timing['calls'] += 1
+
+            timing['seconds'] += default_timer() - start
+            entry['elapsed'] = 0.
+
+        self._current_step += 1
+
+    def run(self, dt, n_steps):
+        """Run the model for *n_steps* steps of length *dt*."""
+        for _ in range(n_steps):
+            self.run_one_step(dt)
+
+    def report(self):
+        """A table of the time spent in each component."""
+        lines = ['{0:<30} {1:>8} {2:>8} {3:>10}'.format(
+            'component', 'calls', 'skips', 'seconds')]
+        for entry in self._entries:
+            timing = self._timings[entry['name']]
+            lines.append('{0:<30} {1:>8} {2:>8} {3:>10.3f}'.format(
+                entry['name'], timing['calls'], timing['skips'],
+                timing['seconds']))
+        return '\n'.join(lines)
@@ -0,0 +1,283 @@
+"""Lazy post-processing of stored Landlab model snapshots.
+
+Snapshots of grid fields are written, one netCDF file per model time, by a
+``SnapshotWriter``. ``open_snapshots`` reads a directory of snapshots back as
+an xarray Dataset of dask arrays with dimensions ``(time, node)`` (or
+``cell``, ``link``, ...) and the grid coordinates of each element, so
+reductions over time or space run chunk by chunk, in parallel, without
+loading the whole stack into memory. ``open_array_snapshots`` does the same
+for a stack of snapshots saved with ``np.save`` (for instance the
+``VegType`` array of the ecohydrology tutorials).
+"""
+import glob
+import os
+
+import dask.array as da
+import numpy as np
+import xarray as xr
+
+
+def _element_coords(grid, at):
+    """x and y coordinates of the elements of a grid."""
+    if at == 'node':
+        return grid.x_of_node, grid.y_of_node
+    elif at == 'cell':
+        return (grid.x_of_node[grid.node_at_cell],
+                grid.y_of_node[grid.node_at_cell])
+    elif at == 'link':
+        return grid.x_of_link, grid.y_of_link
+    else:
+        raise ValueError('snapshots at {at} are not supported'.format(at=at))
+
+
+class SnapshotWriter(object):
+    """Save snapshots of grid fields, one netCDF file per model time.
+
+    Parameters
+    ----------
+    grid : ModelGrid
+        A Landlab grid.
+    path : str
+        Directory of the snapshot files. Snapshots from a previous run in
+        this directory are removed, so that ``open_snapshots`` only sees
+        those of this run.
+    names : list of str, optional
+        Names of the fields to save. By default, all fields at *at* when
+        each snapshot is taken.
+    at : str, optional
+        Grid element of the fields.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> from landlab import RasterModelGrid
+    >>> grid = RasterModelGrid((3, 4))
+    >>> z = grid.add_zeros('node', 'topographic__elevation')
+    >>> path = tempfile.mkdtemp()
+    >>> writer = SnapshotWriter(grid, path)
+    >>> for t in (0., 10., 20.):
+    ...     z += 1.
+    ...     _ = writer.save(t)
+    >>> writer.number_of_snapshots
+    3
+    >>> snapshots = open_snapshots(path)
+    >>> snapshots['topographic__elevation'].mean(dim='node').values
+    array([1., 2., 3.])
+
+    A new writer in the same directory starts a new set of snapshots.
+
+    >>> writer = SnapshotWriter(grid, path)
+    >>> _ = writer.save(30.)
+    >>> open_snapshots(path)['time'].values
+    array([30.])
+    """
+
+    def __init__(self, grid, path, names=None, at='node'):
+        self._grid = grid
+        self._path = path
+        self._names = names
+        self._at = at
+        self._count = 0
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for filename in glob.glob(os.path.join(path, 'snapshot_*.nc')):
+            os.remove(filename)
+
+    @property
+    def number_of_snapshots(self):
+        """Number of snapshots saved so far."""
+        return self._count
+
+    def save(self, time):
+        """Save the fields at a model time.
+
+        Parameters
+        ----------
+        time : float
+            Model time of the snapshot.
+
+        Returns
+        -------
+        str
+            Path to the snapshot file.
+        """
+        grid, at = self._grid, self._at
+        names = self._names
+        if names is None:
+            names = list(grid[at].keys())
+
+        x, y = _element_coords(grid, at)
+        dataset = xr.Dataset(
+            data_vars=dict((name, ((at, ), grid[at][name].copy()))
+                           for name in names),
+            coords={'x': ((at, ), x), 'y': ((at, ), y)})
+        dataset = dataset.expand_dims(time=[float(time)])
+
+        filename = os.path.join(self._path,
+                                'snapshot_%06d.nc' % self._count)
+        dataset.to_netcdf(filename)
+        self._count += 1
+
+        return filename
+
+
+def open_snapshots(path, chunks=None):
+    """Open a directory of snapshots as a Dataset of dask arrays.
+
+    Parameters
+    ----------
+    path : str
+        Directory of files written by a ``SnapshotWriter``.
+    chunks : dict, optional
+        Chunk sizes of the returned dask arrays. By default each snapshot is
+        a chunk. Use, for instance, ``{'time': 100}`` to group snapshots
+        into larger chunks.
+
+    Returns
+    -------
+    xarray.Dataset
+        Fields with dimensions ``(time, <element>)``, with ``x`` and ``y``
+        coordinates along the element dimension.
+    """
+    filenames = sorted(glob.glob(os.path.join(path, 'snapshot_*.nc')))
+    if not filenames:
+        raise IOError('no snapshots in {path}'.format(path=path))
+
+    dataset = xr.open_mfdataset(filenames, combine='nested',
+                                concat_dim='time', coords='minimal',
+                                data_vars='minimal', compat='override')
+    if chunks:
+        dataset = dataset.chunk(chunks)
+
+    return dataset.assign_coords(x=dataset['x'].load(),
+                                 y=dataset['y'].load())
+
+
+def open_array_snapshots(filename, grid, at='cell', name=None, time=None,
+                         chunks=1):
+    """Open a stack of snapshots saved with ``np.save`` as a dask array.
+
+    The file is memory-mapped, so only the chunks used by a computation are
+    read from disk.
+
+    Parameters
+    ----------
+    filename : str
+        A ``.npy`` file that holds a number-of-times by
+        number-of-elements array.
+    grid : ModelGrid
+        The grid on which the snapshots were taken.
+    at : str, optional
+        Grid element of the snapshots.
+    name : str, optional
+        Name of the returned DataArray.
+    time : array_like, optional
+        Model time of each snapshot. If given, only the first ``len(time)``
+        rows of the file are used.
+    chunks : int, optional
+        Number of snapshots per chunk.
+
+    Returns
+    -------
+    xarray.DataArray
+        Snapshots with dimensions ``(time, <element>)``.
+
+    Examples
+    --------
+    >>> import os
+    >>> import tempfile
+    >>> import numpy as np
+    >>> from landlab import RasterModelGrid
+    >>> grid = RasterModelGrid((4, 4))
+
+    Save a vegetation type at each cell for three years, as the
+    ecohydrology tutorials do with their ``VegType`` array.
+
+    >>> veg_type = np.array([[0, 0, 1, 3], [0, 1, 1, 3], [1, 1, 1, 3]])
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'VegType.npy')
+    >>> np.save(filename, veg_type)
+    >>> veg = open_array_snapshots(filename, grid, name='VegType',
+    ...                            time=[2000., 2001., 2002.])
+    >>> veg.dims
+    ('time', 'cell')
+    >>> percent_cover(veg, [1]).values
+    array([25., 50., 75.])
+    """
+    values = np.load(filename, mmap_mode='r')
+    if time is None:
+        time = np.arange(values.shape[0])
+    values = values[:len(time)]
+
+    x, y = _element_coords(grid, at)
+    return xr.DataArray(da.from_array(values, chunks=(chunks, -1)),
+                        dims=('time', at), name=name,
+                        coords={'time': np.asarray(time, dtype=float),
+                                'x': ((at, ), x), 'y': ((at, ), y)})
+
+
+def as_raster(data, grid):
+    """Reshape snapshots on a raster grid into rows and columns.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        Snapshots at nodes or cells of a RasterModelGrid, with the element
+        dimension last.
+    grid : RasterModelGrid
+        The grid on which the snapshots were taken.
+
+    Returns
+    -------
+    xarray.DataArray
+        Snapshots with the element dimension replaced by ``y`` and ``x``
+        dimensions, ready to be used with, for instance,
+        ``holoviews.Dataset(...).to(holoviews.Image, ['x', 'y'])``.
+    """
+    at = data.dims[-1]
+    if at == 'node':
+        shape = grid.shape
+    elif at == 'cell':
+        shape = (grid.shape[0] - 2, grid.shape[1] - 2)
+    else:
+        raise ValueError('only node and cell snapshots can be reshaped')
+
+    x = data['x'].values.reshape(shape)
+    y = data['y'].values.reshape(shape)
+    values = data.data
+    if isinstance(values, da.Array):
+        values = values.rechunk({values.ndim - 1: -1})
+
+    coords = dict((dim, data[dim]) for dim in data.dims[:-1])
+    coords.update(y=y[:, 0], x=x[0, :])
+
+    return xr.DataArray(values.reshape(data.shape[:-1] + shape),
+                        dims=data.dims[:-1] + ('y', 'x'), name=data.name,
+                        coords=coords)
+
+
+def percent_cover(data, values):
+    """Percentage of elements whose value is one of *values* at each time.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        Snapshots with dimensions ``(time, <element>)``.
+    values : list
+        Values counted as covered, for instance the plant functional types
+        that make up the shrub cover.
+
+    Returns
+    -------
+    xarray.DataArray
+        Percent cover at each time.
+
+    Examples
+    --------
+    >>> import xarray as xr
+    >>> data = xr.DataArray([[0, 1, 2, 1], [1, 1, 2, 2]],
+    ...                     dims=('time', 'cell'), coords={'time': [0., 1.]})
+    >>> percent_cover(data, [1, 2]).values
+    array([ 75., 100.])
+    """
+    return data.isin(values).mean(dim=data.dims[-1]) * 100.